@@ -9,24 +9,158 @@ The instrumentation checks for required dependencies and versions before
 applying AWS X-Ray patches to ensure compatibility.
 """
 
-import logging
 import os
+import sys
 
-logger = logging.getLogger("python-lambda-aws-xray")
-# Configure logging to stdout
-handler = logging.StreamHandler()
-handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
-handler.stream = os.sys.stdout
-logger.addHandler(handler)
-logger.setLevel(logging.INFO)
+LOGGER_NAME = "python-lambda-aws-xray"
+
+# AWS X-Ray SDK for Python requires botocore >= 1.11.3
+MIN_BOTOCORE_VERSION = (1, 11, 3)
+
+# Libraries whose patching can wait until botocore.session is imported
+DEFERRABLE_LIBRARIES = {"botocore", "boto3"}
+
+# Set by setup(); debug messages are dropped without importing logging otherwise
+_debug_enabled = False
+
+
+def _logger():
+    # logging is imported lazily so that interpreter startup does not pay for
+    # it (and threading, weakref, ...) unless something is actually logged
+    import logging
+
+    return logging.getLogger(LOGGER_NAME)
+
+
+def _debug(msg):
+    if _debug_enabled:
+        _logger().debug(msg)
+
+
+def _warn(msg):
+    _logger().warning(msg)
+
+
+def _error(msg):
+    import traceback
+
+    logger = _logger()
+    logger.error(msg)
+    logger.error(traceback.format_exc())
 
 
 def setup():
     """
     Setup the AWS X-Ray instrumentation.
+
+    Logging verbosity is controlled by AWS_LAMBDA_AWS_XRAY_LOGGING_LEVEL.
+    A dedicated stdout handler is only built for DEBUG; otherwise warnings
+    propagate to the root logger (or Python's last-resort stderr handler),
+    which Lambda forwards to CloudWatch.
+    """
+    global _debug_enabled
+
+    if os.environ.get("AWS_LAMBDA_AWS_XRAY_LOGGING_LEVEL", "INFO") != "DEBUG":
+        return
+
+    import logging
+
+    # Configure logging to stdout
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(
+        logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    )
+    logger = _logger()
+    logger.addHandler(handler)
+    logger.setLevel(logging.DEBUG)
+    _debug_enabled = True
+
+
+def _is_supported_botocore_version(botocore_version):
     """
-    if os.environ.get("AWS_LAMBDA_AWS_XRAY_LOGGING_LEVEL", "INFO") == "DEBUG":
-        logger.setLevel(logging.DEBUG)
+    Check whether the given botocore version is >= MIN_BOTOCORE_VERSION.
+
+    Any 1.12+ or 2+ version passes on its major/minor components alone,
+    which covers every botocore shipped by current Lambda runtimes. Other
+    plain "X.Y.Z" versions are compared as integer tuples. Only versions that
+    cannot be parsed this way (e.g. pre-releases) fall back to packaging,
+    avoiding its import (and re) on interpreter startup. packaging is not
+    shipped in the layer, so None is returned when it is unavailable.
+    """
+    parts = botocore_version.split(".")
+    try:
+        major, minor = int(parts[0]), int(parts[1])
+        if (major, minor) > MIN_BOTOCORE_VERSION[:2]:
+            return True
+        if (major, minor) < MIN_BOTOCORE_VERSION[:2]:
+            return False
+        return tuple(int(x) for x in parts[:3]) >= MIN_BOTOCORE_VERSION
+    except (ValueError, IndexError):
+        try:
+            from packaging import version
+        except ImportError:
+            return None
+
+        return version.parse(botocore_version) >= version.parse(
+            ".".join(map(str, MIN_BOTOCORE_VERSION))
+        )
+
+
+def _find_botocore_version(spec):
+    """
+    Return the installed botocore version without importing botocore.
+
+    The version is taken from the botocore-<version>.dist-info directory next
+    to the package, which only costs a directory listing. importlib.metadata
+    is used as a fallback because importing it is slower than importing
+    botocore itself. Returns None when no metadata is found.
+    """
+    if spec.origin:
+        site_dir = os.path.dirname(os.path.dirname(spec.origin))
+        prefix, suffix = "botocore-", ".dist-info"
+        try:
+            for name in os.listdir(site_dir):
+                if name.startswith(prefix) and name.endswith(suffix):
+                    return name[len(prefix):-len(suffix)]
+        except OSError:
+            pass
+
+    from importlib.metadata import PackageNotFoundError, version
+
+    try:
+        return version("botocore")
+    except PackageNotFoundError:
+        return None
+
+
+def _libraries_to_patch():
+    """
+    Return the libraries to patch from AWS_LAMBDA_AWS_XRAY_PATCH.
+
+    The variable holds a comma-separated list of library names supported by
+    aws_xray_sdk (e.g. "botocore,requests"), or "all" to patch every supported
+    library. "all" anywhere in the list wins and yields ("all",). Defaults to
+    botocore only.
+    """
+    value = os.environ.get("AWS_LAMBDA_AWS_XRAY_PATCH", "botocore")
+    libs = tuple(lib.strip() for lib in value.split(",") if lib.strip())
+    if "all" in libs:
+        return ("all",)
+    return libs or ("botocore",)
+
+
+def _is_importable(name):
+    """
+    Return whether a module or package can be found without importing it.
+
+    For dotted names the parent packages are imported, as with any import.
+    """
+    import importlib.util
+
+    try:
+        return importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError):
+        return False
 
 
 def instrument():
@@ -34,52 +168,198 @@ def instrument():
     Automatically instruments Python code with AWS X-Ray tracing.
 
     This function performs the following steps:
-    1. Checks if botocore is available in the runtime
-    2. Verifies botocore version meets minimum requirement (>=1.11.3)
-    3. Applies AWS X-Ray patching to common AWS services and libraries
+    1. Checks that it runs inside Lambda with X-Ray tracing active and not disabled
+    2. Checks if botocore and aws_xray_sdk are available in the runtime
+    3. Verifies botocore version meets minimum requirement (>=1.11.3)
+    4. Applies AWS X-Ray patching to the libraries listed in AWS_LAMBDA_AWS_XRAY_PATCH,
+       deferred until botocore.session is first imported when only botocore
+       or boto3 is listed
 
     The function gracefully handles missing dependencies by logging warnings
     and continuing without instrumentation rather than failing.
     """
+    # sitecustomize may be executed again in a process that is already
+    # instrumented (e.g. after a snapshot restore); patching once is enough
+    if getattr(sys, "_xray_instrumented", False):
+        _debug("AWS X-Ray instrumentation already applied")
+        return
+
+    # Outside of Lambda (local interpreters, pytest runs with the layer on
+    # PYTHONPATH) there is nothing to trace
+    if not os.environ.get("AWS_LAMBDA_FUNCTION_NAME"):
+        return
+
+    # Skip all imports below when instrumentation is explicitly disabled or
+    # when the function is not traced (Lambda only sets these when tracing is active)
+    if os.environ.get("AWS_LAMBDA_AWS_XRAY_DISABLED", "").lower() in ("1", "true"):
+        _debug("AWS X-Ray instrumentation is disabled")
+        return
+
+    if not os.environ.get("AWS_XRAY_DAEMON_ADDRESS") and "_X_AMZN_TRACE_ID" not in os.environ:
+        _debug("AWS X-Ray tracing is not active. Skipping AWS X-Ray instrumentation.")
+        return
+
     # Check if botocore is available in the Lambda runtime
     # botocore is provided by Lambda runtime but not included in the layer
-    logger.debug("Instrumenting AWS X-Ray")
+    _debug("Instrumenting AWS X-Ray")
 
-    try:
-        import botocore
-        logger.debug("botocore package is available")
-    except ImportError:
-        logger.warning(
+    # Locate both packages without executing them; they are only imported
+    # once user code loads botocore
+    import importlib.util
+
+    spec = importlib.util.find_spec("botocore")
+    if spec is None:
+        _warn(
             "botocore package is not available. Skipping AWS X-Ray instrumentation."
         )
         return
+    _debug("botocore package is available")
+
+    if importlib.util.find_spec("aws_xray_sdk") is None:
+        _warn(
+            "aws_xray_sdk package is not available. Skipping AWS X-Ray instrumentation."
+        )
+        return
 
     # Verify botocore version meets AWS X-Ray SDK requirements
     # AWS X-Ray SDK for Python requires botocore >= 1.11.3
-    from packaging import version
+    botocore_version = _find_botocore_version(spec)
+    if botocore_version is None:
+        _warn(
+            "botocore version could not be determined. Skipping AWS X-Ray instrumentation."
+        )
+        return
 
-    if version.parse(botocore.__version__) < version.parse("1.11.3"):
-        logger.warning(
-            f"botocore version {botocore.__version__} is less than required 1.11.3. Skipping AWS X-Ray instrumentation."
+    supported = _is_supported_botocore_version(botocore_version)
+    if supported is None:
+        _warn(
+            f"botocore version {botocore_version} could not be compared with required 1.11.3. Skipping AWS X-Ray instrumentation."
+        )
+        return
+    if not supported:
+        _warn(
+            f"botocore version {botocore_version} is less than required 1.11.3. Skipping AWS X-Ray instrumentation."
         )
         return
 
-    logger.debug("botocore version is >= 1.11.3")
+    _debug("botocore version is >= 1.11.3")
 
-    # Import and apply AWS X-Ray patching to common services
-    # patch_all() instruments boto3, botocore, requests, and other supported libraries
-    try:
-        from aws_xray_sdk.core import patch_all
+    # Defer patching until user code imports botocore.session, so handlers that
+    # never call AWS do not pay for importing aws_xray_sdk during init.
+    # botocore.session (not botocore.client) is the trigger because the SDK
+    # creates a botocore session on import, and botocore.session imports
+    # botocore.client while it is still initializing.
+    # Only botocore (and boto3, which the SDK patches through botocore) can
+    # wait for that trigger; any other library is patched right away so a
+    # handler that never imports botocore is still traced
+    libs = _libraries_to_patch()
+    if "botocore.session" in sys.modules or not set(libs) <= DEFERRABLE_LIBRARIES:
+        apply_patches(libs)
+    else:
+        _debug("Deferring AWS X-Ray patching until botocore.session is imported")
+        sys.meta_path.insert(0, _XRayImportHook(libs))
+
+    sys._xray_instrumented = True
+
+
+def apply_patches(libs):
+    """
+    Import aws_xray_sdk and patch the given libraries.
+
+    instrument() has already checked that aws_xray_sdk is installed.
+
+    Args:
+        libs: tuple of library names to patch, or ("all",) to patch every
+            library supported by aws_xray_sdk
+    """
+    # Patching only what is needed avoids importing every library supported by the SDK
+    if libs == ("all",):
+        from aws_xray_sdk.core.patcher import patch_all
 
         # double_patch=True allows re-patching if called multiple times
-        logger.debug("patching all")
+        _debug("patching all")
         patch_all(double_patch=True)
-        logger.debug("AWS X-Ray instrumentation successfully applied.")
-    except ImportError:
-        logger.warning(
-            "aws_xray_sdk package is not available. Skipping AWS X-Ray instrumentation."
-        )
-        return
+    else:
+        from aws_xray_sdk.core.patcher import SUPPORTED_MODULES, patch
+
+        # patch() accepts SDK integrations (plus the boto3/aioboto3 aliases) and
+        # importable local modules, whose functions it wraps with
+        # xray_recorder.capture. Any other name makes it raise for the whole
+        # call even with raise_errors=False, so drop such names up front
+        supported = set(SUPPORTED_MODULES) | {"boto3", "aioboto3"}
+        unknown = [lib for lib in libs if lib not in supported and not _is_importable(lib)]
+        if unknown:
+            _warn(
+                f"Ignoring unknown libraries that are neither supported by AWS X-Ray nor importable: {', '.join(unknown)}"
+            )
+            libs = tuple(lib for lib in libs if lib not in unknown)
+            if not libs:
+                _warn("No libraries left to patch. Skipping AWS X-Ray instrumentation.")
+                return
+
+        _debug(f"patching {', '.join(libs)}")
+        patch(libs, raise_errors=False)
+    _debug("AWS X-Ray instrumentation successfully applied.")
+
+
+class _XRayImportHook:
+    """
+    Meta path finder that applies X-Ray patching once botocore.session is loaded.
+
+    It never loads modules itself: for botocore.session it resolves the spec
+    through the remaining finders and wraps its loader, then removes itself
+    from sys.meta_path.
+    """
+
+    def __init__(self, libs):
+        self._libs = libs
+
+    def find_spec(self, fullname, path=None, target=None):
+        if fullname != "botocore.session":
+            return None
+
+        sys.meta_path.remove(self)
+        for finder in sys.meta_path:
+            find_spec = getattr(finder, "find_spec", None)
+            if find_spec is None:
+                continue
+            spec = find_spec(fullname, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+
+        if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+            spec.loader = _PatchingLoader(spec.loader, self._libs)
+        return spec
+
+
+class _PatchingLoader:
+    """
+    Loader wrapper that applies X-Ray patching after the wrapped module executes.
+    """
+
+    def __init__(self, loader, libs):
+        self._loader = loader
+        self._libs = libs
+
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        self._loader.exec_module(module)
+        # The import system binds the submodule to its parent package only after
+        # exec_module returns; do it now so the SDK can reach botocore.session
+        parent, _, child = module.__name__.rpartition(".")
+        setattr(sys.modules[parent], child, module)
+        # Never let instrumentation errors break the user's import of botocore
+        try:
+            apply_patches(self._libs)
+        except Exception as e:
+            _error(f"Failed to apply X-Ray instrumentation: {e}")
 
 
 # Automatically instrument when the module is imported
@@ -88,6 +368,4 @@ try:
     setup()
     instrument()
 except Exception as e:
-    logger.error(f"Failed to setup X-Ray instrumentation: {e}")
-    import traceback
-    logger.error(traceback.format_exc())
+    _error(f"Failed to setup X-Ray instrumentation: {e}")
@@ -0,0 +1,11 @@
+import functools
+from pathlib import Path
+
+
+@functools.cache
+def find_project_root() -> Path:
+    """Return the nearest parent directory containing pyproject.toml."""
+    current_dir = Path(__file__).parent
+    while not (current_dir / "pyproject.toml").exists():
+        current_dir = current_dir.parent
+    return current_dir
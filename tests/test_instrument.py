@@ -0,0 +1,271 @@
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import textwrap
+import types
+import pytest
+
+from tests._utils import find_project_root
+
+LAYER_PYTHON_PATH = find_project_root() / "aws_lambda_layer" / "bin" / "python"
+
+# Environment of a traced Lambda function
+LAMBDA_ENV = {
+    "AWS_LAMBDA_FUNCTION_NAME": "xray-test",
+    "AWS_XRAY_DAEMON_ADDRESS": "127.0.0.1:2000",
+}
+
+# Reports whether the layer instrumented the interpreter it runs in
+REPORT_SCRIPT = """
+import json
+import sys
+
+import wrapt
+
+hooks = [f for f in sys.meta_path if type(f).__name__ == "_XRayImportHook"]
+sdk_loaded_at_startup = "aws_xray_sdk" in sys.modules
+
+import botocore.session
+import botocore.client
+
+print(json.dumps({
+    "hooks": len(hooks),
+    "sdk_loaded_at_startup": sdk_loaded_at_startup,
+    "sdk_loaded": "aws_xray_sdk" in sys.modules,
+    "botocore_patched": isinstance(
+        botocore.client.BaseClient.__dict__["_make_api_call"], wrapt.FunctionWrapper
+    ),
+    "hook_removed": not any(
+        type(f).__name__ == "_XRayImportHook" for f in sys.meta_path
+    ),
+}))
+"""
+
+
+@pytest.fixture
+def sitecustomize(monkeypatch):
+    """Load sitecustomize.py as a module without instrumenting the test process."""
+    monkeypatch.delenv("AWS_LAMBDA_FUNCTION_NAME", raising=False)
+    spec = importlib.util.spec_from_file_location(
+        "_sitecustomize_under_test", LAYER_PYTHON_PATH / "sitecustomize.py"
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.mark.parametrize(
+    "botocore_version, expected",
+    [
+        ("1.11.3", True),
+        ("1.11.10", True),
+        ("1.11.2", False),
+        ("1.11", False),
+        ("1.10.99", False),
+        ("1.12.0", True),
+        ("1.34.0", True),
+        ("2.0.0", True),
+        ("0.9.1", False),
+        ("1.11.3rc1", False),
+        ("1.11.4rc1", True),
+    ],
+)
+def test_is_supported_botocore_version(sitecustomize, botocore_version, expected):
+    assert sitecustomize._is_supported_botocore_version(botocore_version) is expected
+
+
+def test_is_supported_botocore_version_without_packaging(sitecustomize, monkeypatch):
+    """Pre-releases need packaging, which is not shipped in the layer."""
+    monkeypatch.setitem(sys.modules, "packaging", None)
+
+    assert sitecustomize._is_supported_botocore_version("1.11.3rc1") is None
+    # Plain versions never need packaging
+    assert sitecustomize._is_supported_botocore_version("1.34.0") is True
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        (None, ("botocore",)),
+        ("", ("botocore",)),
+        ("botocore", ("botocore",)),
+        (" botocore , requests ,", ("botocore", "requests")),
+        ("all", ("all",)),
+        ("botocore,all", ("all",)),
+    ],
+)
+def test_libraries_to_patch(sitecustomize, monkeypatch, value, expected):
+    if value is None:
+        monkeypatch.delenv("AWS_LAMBDA_AWS_XRAY_PATCH", raising=False)
+    else:
+        monkeypatch.setenv("AWS_LAMBDA_AWS_XRAY_PATCH", value)
+
+    assert sitecustomize._libraries_to_patch() == expected
+
+
+@pytest.fixture
+def fake_patcher(monkeypatch):
+    """Replace aws_xray_sdk.core.patcher with a recorder of patch calls."""
+    patcher = types.ModuleType("aws_xray_sdk.core.patcher")
+    patcher.SUPPORTED_MODULES = ("botocore", "requests", "httplib")
+    patcher.calls = []
+    patcher.patch = lambda libs, raise_errors=True: patcher.calls.append(("patch", libs))
+    patcher.patch_all = lambda double_patch=False: patcher.calls.append(("patch_all", double_patch))
+    monkeypatch.setitem(sys.modules, "aws_xray_sdk.core.patcher", patcher)
+    return patcher
+
+
+def test_apply_patches_ignores_unsupported_libraries(sitecustomize, fake_patcher):
+    sitecustomize.apply_patches(("boto3", "reqests", "requests"))
+
+    assert fake_patcher.calls == [("patch", ("boto3", "requests"))]
+
+
+def test_apply_patches_keeps_importable_local_modules(sitecustomize, fake_patcher):
+    """patch() wraps the functions of any importable module, not only SDK integrations."""
+    sitecustomize.apply_patches(("botocore", "json", "reqests", "nosuchpkg.sub"))
+
+    assert fake_patcher.calls == [("patch", ("botocore", "json"))]
+
+
+def test_apply_patches_skips_when_nothing_is_supported(sitecustomize, fake_patcher):
+    sitecustomize.apply_patches(("reqests",))
+
+    assert fake_patcher.calls == []
+
+
+def test_apply_patches_all(sitecustomize, fake_patcher):
+    sitecustomize.apply_patches(("all",))
+
+    assert fake_patcher.calls == [("patch_all", True)]
+
+
+def _run_with_layer(script: str, **env: str) -> dict:
+    """
+    Run a fresh interpreter with the layer's sitecustomize.py on PYTHONPATH
+    and return the JSON object the script prints last.
+    """
+    process_env = {
+        key: value
+        for key, value in os.environ.items()
+        if not key.startswith(("AWS_", "_X_AMZN_"))
+    }
+    process_env.update(env)
+    process_env["PYTHONPATH"] = os.pathsep.join(
+        filter(None, [str(LAYER_PYTHON_PATH), os.environ.get("PYTHONPATH")])
+    )
+
+    result = subprocess.run(
+        [sys.executable, "-c", textwrap.dedent(script)],
+        env=process_env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+def test_botocore_patching_is_deferred_until_import():
+    report = _run_with_layer(REPORT_SCRIPT, **LAMBDA_ENV)
+
+    assert report["hooks"] == 1
+    assert not report["sdk_loaded_at_startup"]
+    assert report["botocore_patched"]
+    assert report["hook_removed"]
+
+
+@pytest.mark.parametrize(
+    "env",
+    [
+        pytest.param(
+            {"AWS_XRAY_DAEMON_ADDRESS": "127.0.0.1:2000"}, id="outside-lambda"
+        ),
+        pytest.param(
+            {"AWS_LAMBDA_FUNCTION_NAME": "xray-test"}, id="tracing-not-active"
+        ),
+        pytest.param(
+            {**LAMBDA_ENV, "AWS_LAMBDA_AWS_XRAY_DISABLED": "1"}, id="disabled"
+        ),
+    ],
+)
+def test_instrumentation_is_skipped(env):
+    report = _run_with_layer(REPORT_SCRIPT, **env)
+
+    assert report["hooks"] == 0
+    assert not report["sdk_loaded"]
+    assert not report["botocore_patched"]
+
+
+def test_instrumentation_runs_once_per_process():
+    report = _run_with_layer(
+        """
+        import importlib
+        import json
+        import sys
+
+        import sitecustomize
+
+        importlib.reload(sitecustomize)
+        print(json.dumps({
+            "instrumented": getattr(sys, "_xray_instrumented", False),
+            "hooks": sum(
+                type(f).__name__ == "_XRayImportHook" for f in sys.meta_path
+            ),
+        }))
+        """,
+        **LAMBDA_ENV,
+    )
+
+    assert report == {"instrumented": True, "hooks": 1}
+
+
+def test_non_botocore_libraries_are_patched_at_startup():
+    pytest.importorskip("requests")
+
+    report = _run_with_layer(
+        """
+        import json
+        import sys
+
+        import wrapt
+
+        sdk_loaded_at_startup = "aws_xray_sdk" in sys.modules
+
+        import requests
+
+        print(json.dumps({
+            "sdk_loaded_at_startup": sdk_loaded_at_startup,
+            "requests_patched": isinstance(
+                requests.Session.__dict__["request"], wrapt.FunctionWrapper
+            ),
+        }))
+        """,
+        **LAMBDA_ENV,
+        AWS_LAMBDA_AWS_XRAY_PATCH="requests",
+    )
+
+    assert report == {"sdk_loaded_at_startup": True, "requests_patched": True}
+
+
+def test_patch_all_patches_httplib_at_startup():
+    report = _run_with_layer(
+        """
+        import http.client
+        import json
+
+        import wrapt
+
+        print(json.dumps({
+            "httplib_patched": isinstance(
+                http.client.HTTPConnection.__dict__["getresponse"],
+                wrapt.FunctionWrapper,
+            ),
+        }))
+        """,
+        **LAMBDA_ENV,
+        AWS_LAMBDA_AWS_XRAY_PATCH="all",
+    )
+
+    assert report == {"httplib_patched": True}
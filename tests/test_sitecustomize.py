@@ -1,3 +1,4 @@
+import hashlib
 import logging
 import pytest
 import docker
@@ -6,6 +7,8 @@ from dataclasses import dataclass
 from pathlib import Path
 from typing import Generator
 
+from tests._utils import find_project_root
+
 logger = logging.getLogger(__name__)
 
 
@@ -23,7 +26,7 @@ def test_container(request) -> Generator[TestContext, None, None]:
     import tempfile
     import shutil
 
-    project_root = _find_project_root()
+    project_root = find_project_root()
     layer_zip = project_root / "dist" / "layer.zip"
     assert (
         layer_zip.exists()
@@ -43,9 +46,11 @@ def test_container(request) -> Generator[TestContext, None, None]:
 
         request.addfinalizer(fin_temp_dir)
 
-        # Unzip the layer.zip into temp directory
+        # Extract only the bin/ tree of layer.zip, the part mounted into the container
         with zipfile.ZipFile(layer_zip, "r") as zip_ref:
-            zip_ref.extractall(temp_path)
+            for member in zip_ref.namelist():
+                if member.startswith("bin/"):
+                    zip_ref.extract(member, temp_path)
         
         # Ensure bootstrap script has executable permissions
         bootstrap_path = temp_path / "bin" / "bootstrap"
@@ -53,29 +58,28 @@ def test_container(request) -> Generator[TestContext, None, None]:
             import stat
             bootstrap_path.chmod(stat.S_IRWXU | stat.S_IRGRP | stat.S_IXGRP | stat.S_IROTH | stat.S_IXOTH)
 
-        # Build docker image from Dockerfile
+        # Build docker image from Dockerfile, reusing a previously built image
+        # when the build inputs are unchanged
         dockerfile_path = Path(__file__).parent / "Dockerfile"
         test_dir = Path(__file__).parent
+        tag = _image_tag(dockerfile_path, test_dir / "app.py")
 
-        logger.debug(
-            f"Building image from {test_dir} with Dockerfile {dockerfile_path}"
-        )
-        image, _ = client.images.build(
-            path=str(test_dir), dockerfile=str(dockerfile_path), tag="xray-test:latest"
-        )
-        logger.debug(f"Image built: {image.id}")
+        try:
+            image = client.images.get(tag)
+            logger.debug(f"Reusing image {tag}: {image.id}")
+        except docker.errors.ImageNotFound:
+            logger.debug(
+                f"Building image {tag} from {test_dir} with Dockerfile {dockerfile_path}"
+            )
+            image, _ = client.images.build(
+                path=str(test_dir), dockerfile=str(dockerfile_path), tag=tag, pull=True
+            )
+            logger.debug(f"Image built: {image.id}")
+            _remove_stale_images(client, tag)
 
         # Check if bin directory exists in extracted layer
         layer_bin_path = temp_path / "bin"
 
-        # Clean up image
-        def fin_2():
-            logger.debug("Removing image")
-            client.images.remove(image.id, force=True)
-            logger.debug("Image removed")
-
-        request.addfinalizer(fin_2)
-
         yield TestContext(
             client=client,
             layer_path=layer_bin_path,
@@ -83,6 +87,31 @@ def test_container(request) -> Generator[TestContext, None, None]:
         )
 
 
+def test_layer_ships_precompiled_sitecustomize():
+    """
+    /opt is mounted read-only, so Python cannot cache bytecode there itself.
+    The layer must ship sitecustomize's .pyc for the interpreter it was built
+    with (make PYTHON=...), whichever version that is.
+    """
+    import re
+    import zipfile
+
+    layer_zip = find_project_root() / "dist" / "layer.zip"
+    assert (
+        layer_zip.exists()
+    ), f"Layer zip file does not exist: {layer_zip}, run make before running this test"
+
+    with zipfile.ZipFile(layer_zip, "r") as zip_ref:
+        names = set(zip_ref.namelist())
+
+    assert "bin/python/sitecustomize.py" in names
+    # Plain (non-optimized) bytecode for any CPython version
+    pyc = re.compile(r"bin/python/__pycache__/sitecustomize\.cpython-\d+\.pyc")
+    assert any(
+        pyc.fullmatch(name) for name in names
+    ), "No precompiled sitecustomize.pyc found in the layer"
+
+
 def test_aws_lambda_exec_wrapper(request, test_container: TestContext):
     """
     This test checks that AWS_LAMBDA_EXEC_WRAPPER really works.
@@ -127,6 +156,8 @@ def test_sitecustomize(request, test_container: TestContext):
         environment={
             "AWS_LAMBDA_EXEC_WRAPPER": "/opt/bin/bootstrap",
             "AWS_LAMBDA_AWS_XRAY_LOGGING_LEVEL": "DEBUG",
+            "AWS_XRAY_DAEMON_ADDRESS": "127.0.0.1:2000",
+            "AWS_LAMBDA_FUNCTION_NAME": "xray-test",
             "AWS_LAMBDA_RUNTIME_API": "dummy",
             "TEST_AND_EXIT": "1",
             "TEST_AND_EXIT_TIMEOUT": "2",
@@ -149,13 +180,20 @@ def test_sitecustomize(request, test_container: TestContext):
 
     request.addfinalizer(fin_container)
 
-    container.wait(timeout=3)
-    container.reload()
-    exit_code = container.attrs["State"]["ExitCode"]
-    
+    # wait returns as soon as the container exits; the timeout bounds a hung runtime
+    exit_status = container.wait(timeout=5)
+    exit_code = exit_status["StatusCode"]
+
     logs = container.logs().decode("utf-8")
     print(logs)
 
+    # 127 would mean the wrapper itself could not be executed
+    # (see test_aws_lambda_exec_wrapper)
+    assert exit_code != 127, f"Bootstrap wrapper was not executed: {exit_code}"
+    assert (
+        f"TEST_AND_EXIT: Command exited with code: {exit_code}" in logs
+    ), "Bootstrap did not run the runtime to completion"
+
     assert "Permission denied" not in logs, "Permission denied message found in logs"
     
     # We expect the container to fail with exit code 1 due to no Lambda runtime API,
@@ -163,8 +201,22 @@ def test_sitecustomize(request, test_container: TestContext):
     # assert "Instrumenting AWS X-Ray" in logs, "Instrumenting AWS X-Ray message not found in logs"
 
 
-def _find_project_root() -> Path:
-    current_dir = Path(__file__).parent
-    while not (current_dir / "pyproject.toml").exists():
-        current_dir = current_dir.parent
-    return current_dir
+def _remove_stale_images(client: docker.DockerClient, current_tag: str) -> None:
+    """Remove test images built from previous versions of the build inputs."""
+    repository = current_tag.split(":")[0]
+    for stale in client.images.list(name=repository):
+        if current_tag in stale.tags:
+            continue
+        try:
+            client.images.remove(stale.id, force=True)
+            logger.debug(f"Removed stale image {stale.tags}")
+        except docker.errors.APIError as e:
+            logger.warning(f"Could not remove stale image {stale.tags}: {e}")
+
+
+def _image_tag(*build_inputs: Path) -> str:
+    """Tag the test image by the content of the files it is built from."""
+    digest = hashlib.sha256()
+    for path in build_inputs:
+        digest.update(path.read_bytes())
+    return f"xray-test:{digest.hexdigest()[:12]}"